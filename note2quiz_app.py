@@ -1,12 +1,23 @@
 import streamlit as st
 import re
-import time
+import string
+import json
 import os
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+import threading
+import functools
 import io
 import pandas as pd 
+import numpy as np
 from dotenv import load_dotenv 
 import requests  
+from requests.adapters import HTTPAdapter
 from docx import Document   
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 
 load_dotenv() 
 
@@ -16,53 +27,64 @@ STRICT_SYSTEM_INSTRUCTION = (
      "You are a highly analytical academic question generator. "
     "Your only task is to create exam-based questions from the given text. "
     "Avoid conversational language, greetings, or explanations. "
-    "Return only a clean, numbered list of short, exam-style questions."
+    "Return only short, exam-style questions in the requested JSON format."
 )
 
 
 
+# Checked in order, so a question matching several levels gets the first (lowest) one.
+BLOOM_PATTERNS = [
+    ("Knowledge", re.compile(r"define|list|name|what is|who is", re.I)),
+    ("Comprehension", re.compile(r"explain|summarize|describe|identify", re.I)),
+    ("Application", re.compile(r"apply|use|solve|demonstrate", re.I)),
+    ("Analysis", re.compile(r"analyze|compare|contrast|why|examine", re.I)),
+    ("Synthesis", re.compile(r"design|compose|create|what if|develop", re.I)),
+    ("Evaluation", re.compile(r"evaluate|assess|argue|critique|justify", re.I)),
+]
+
+
 def classify_bloom(question):
     """Classifies a question based on simple keyword matching (Bloom's Taxonomy)."""
-    q = question.lower()
-    if any(x in q for x in ["define", "list", "name", "what is", "who is"]):
-        return "Knowledge"
-    elif any(x in q for x in ["explain", "summarize", "describe", "identify"]):
-        return "Comprehension"
-    elif any(x in q for x in ["apply", "use", "solve", "demonstrate"]):
-        return "Application"
-    elif any(x in q for x in ["analyze", "compare", "contrast", "why", "examine"]):
-        return "Analysis"
-    elif any(x in q for x in ["design", "compose", "create", "what if", "develop"]):
-        return "Synthesis"
-    elif any(x in q for x in ["evaluate", "assess", "argue", "critique", "justify"]):
-        return "Evaluation"
-    else:
-        return "Unclassified"
+    for level, pattern in BLOOM_PATTERNS:
+        if pattern.search(question):
+            return level
+    return "Unclassified"
     
-def extract_text_from_pdf(uploaded_file):
+# Extracted text is cached per upload; bound it so server memory doesn't grow with every file.
+EXTRACT_CACHE_ENTRIES = 32
+EXTRACT_CACHE_TTL = 3600
+
+_WS = re.compile(r"\s+")
+_PUNCT_FIX = re.compile(r" ([,.:;?!])")
+
+
+def clean_extracted_text(text):
+    """Collapses whitespace and drops the stray space extractors leave before punctuation."""
+    text = _WS.sub(" ", text)
+    return _PUNCT_FIX.sub(r"\1", text).strip()
+
+@st.cache_data(max_entries=EXTRACT_CACHE_ENTRIES, ttl=EXTRACT_CACHE_TTL)
+def extract_text_from_pdf(file_bytes):
     """Extracts clean, properly spaced text from a PDF using PyMuPDF."""
 
     import fitz  # PyMuPDF
    
-    text = ""
     try:
        
-        with fitz.open(stream=uploaded_file.read(), filetype="pdf") as pdf:
+        # Join words hyphenated across line breaks, on top of the default "text" flags.
+        flags = fitz.TEXTFLAGS_TEXT | fitz.TEXT_DEHYPHENATE
+        # Pages are read sequentially on purpose: PyMuPDF is not thread-safe and holds
+        # the GIL in get_text, so a thread pool would risk crashes without a speedup.
+        # Reruns are covered by st.cache_data instead.
+        parts = []
+        with fitz.open(stream=file_bytes, filetype="pdf") as pdf:
             for page in pdf:
-                page_text = page.get_text("text")  
+                page_text = page.get_text("text", flags=flags)  
                 if page_text:
-                    text += " " + page_text
+                    parts.append(page_text)
 
        
-        text = " ".join(text.split()) 
-        text = (
-            text.replace(" ,", ",")
-                .replace(" .", ".")
-                .replace(" :", ":")
-                .replace(" ;", ";")
-                .replace(" ?", "?")
-                .replace(" !", "!")
-        )
+        text = clean_extracted_text(" ".join(parts))
 
     except Exception as e:
         st.error(f"Error reading PDF: {e}")
@@ -70,25 +92,20 @@ def extract_text_from_pdf(uploaded_file):
 
     return text.strip()
 
-def extract_text_from_csv(uploaded_file):
+@st.cache_data(max_entries=EXTRACT_CACHE_ENTRIES, ttl=EXTRACT_CACHE_TTL)
+def extract_text_from_csv(file_bytes):
     """Extracts and cleans text from a CSV file using pandas."""
     try:
-        uploaded_file.seek(0)
-        df = pd.read_csv(uploaded_file)
+        # Everything is sent to the model as text, so skip dtype inference and NaN detection.
+        df = pd.read_csv(io.BytesIO(file_bytes), dtype=str, engine="c", na_filter=False)
 
         
-        text = df.to_string(index=False, header=True)
+        # Every cell is already a string, so join header and cells (row by row) directly;
+        # a CSV writer would wrap cells holding quotes or tabs and leak quote marks into the prompt.
+        text = " ".join(map(str, df.columns)) + " " + " ".join(df.to_numpy().ravel())
 
       
-        text = " ".join(text.split()) 
-        text = (
-            text.replace(" ,", ",")
-                .replace(" .", ".")
-                .replace(" :", ":")
-                .replace(" ;", ";")
-        )
-
-        return text.strip()
+        return clean_extracted_text(text)
 
     except Exception as e:
         st.error(f"Error reading CSV file: {e}")
@@ -98,16 +115,99 @@ def extract_text_from_csv(uploaded_file):
 
 
 MODEL_NAME = "gemini-2.5-flash"
-def call_gemini(prompt):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        st.error("GEMINI_API_KEY not found")
-        return ""
+GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent"
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent"
-    headers = {"Content-Type": "application/json"}
-    params = {"key": api_key}
+# Bump PROMPT_VERSION whenever a prompt template changes so stale answers are not reused.
+PROMPT_VERSION = "v2"
+CACHE_PATH = "gemini_cache.sqlite3"
+CACHE_TTL = 7 * 86400
+_cache_lock = threading.Lock()
+
+# Cosine similarity above which a chat question reuses the answer to an earlier one.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+
+def _cache_key(prompt, generation_config=None):
+    config = json.dumps(generation_config, sort_keys=True)
+    return hashlib.sha256(f"{PROMPT_VERSION}:{MODEL_NAME}:{config}:{prompt}".encode()).hexdigest()
+
+
+def _open_cache():
+    conn = sqlite3.connect(CACHE_PATH, timeout=10)
+    conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+    return conn
 
+
+def get_cached_response(prompt, generation_config=None):
+    """Returns the stored Gemini response for this exact prompt, or None if missing or expired."""
+    with _cache_lock, closing(_open_cache()) as conn:
+        row = conn.execute(
+            "SELECT text FROM responses WHERE key = ? AND created >= ?",
+            (_cache_key(prompt, generation_config), time.time() - CACHE_TTL),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def store_cached_response(prompt, text, generation_config=None):
+    """Stores a response and deletes expired rows; SQLite reuses their pages, so the file stays bounded."""
+    now = time.time()
+    with _cache_lock, closing(_open_cache()) as conn, conn:
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - CACHE_TTL,))
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, text, created) VALUES (?, ?, ?)",
+            (_cache_key(prompt, generation_config), text, now),
+        )
+
+
+class TokenBucket:
+    """Proactive limiter for Gemini's requests-per-minute and tokens-per-minute quotas.
+
+    Each call reserves capacity up front; when the bucket is in debt the caller
+    waits until it refills instead of sending a request that would get a 429.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, est_tokens):
+        """Takes one request and est_tokens from the bucket and returns the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+            self._requests -= 1
+            self._tokens -= min(est_tokens, self.tpm)
+            return max(0.0, -self._requests * 60 / self.rpm, -self._tokens * 60 / self.tpm)
+
+    def acquire(self, est_tokens=0):
+        time.sleep(self._reserve(est_tokens))
+
+
+# Defaults match the Gemini 2.5 Flash free tier; raise them for paid keys.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "10"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "250000"))
+_BUCKET = TokenBucket(rpm=GEMINI_RPM, tpm=GEMINI_TPM)
+
+
+def estimate_tokens(prompt):
+    """Rough token count (~4 characters per token) used for rate limiting."""
+    return len(prompt) // 4
+
+
+# Shared keep-alive session so chat requests reuse the TLS connection to Gemini.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+
+def _gemini_payload(prompt, generation_config=None):
     payload = {
         "contents": [
             {
@@ -117,39 +217,133 @@ def call_gemini(prompt):
             }
         ]
     }
-    time.sleep(2)
+    if generation_config:
+        payload["generationConfig"] = generation_config
+    return payload
+
+
+def call_gemini(prompt, generation_config=None, validate=None, use_cache=True):
+    """Sends a prompt to Gemini; replies are cached only if validate (when given) accepts them.
+
+    use_cache=False skips the cache lookup (a fresh reply still replaces the stored one).
+    """
+    if use_cache:
+        cached = get_cached_response(prompt, generation_config)
+        if cached is not None:
+            return cached
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        st.error("GEMINI_API_KEY not found")
+        return ""
+
+    headers = {"Content-Type": "application/json"}
+    params = {"key": api_key}
+
+    _BUCKET.acquire(estimate_tokens(prompt))
     try:
-        r = requests.post(
-            url,
+        r = _SESSION.post(
+            GEMINI_URL,
             headers=headers,
             params=params,
-            json=payload,
+            json=_gemini_payload(prompt, generation_config),
             timeout=60
         )
         if r.status_code == 429:
             st.warning("AI is busy right now. Please wait a few seconds ⏳")
             return ""
         r.raise_for_status()
-        return r.json()["candidates"][0]["content"]["parts"][0]["text"]
+        candidate = r.json()["candidates"][0]
+        text = candidate["content"]["parts"][0]["text"]
+        if candidate.get("finishReason") == "MAX_TOKENS" and generation_config:
+            # A JSON reply cut off by maxOutputTokens cannot be parsed; don't cache or return it.
+            st.warning("⚠️ The AI reply hit its length limit before finishing. Try fewer questions.")
+            return ""
+        if validate is None or validate(text):
+            store_cached_response(prompt, text, generation_config)
+        return text
 
     except requests.exceptions.RequestException:
         st.error("Network or API issue. Please try again later.")
         return ""
 
 
+# Notes are cut to a token budget (context slice minus ~256 tokens of instructions),
+# counted with tiktoken's cl100k_base as a local stand-in for Gemini's tokenizer.
+NOTES_TOKEN_BUDGET = 4096 - 256
 
 
+@functools.lru_cache(maxsize=1)
+def get_encoding():
+    """Loads the tokenizer once; None if tiktoken or its BPE file (fetched on first use) is unavailable."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def truncate_to_tokens(text, max_tokens=NOTES_TOKEN_BUDGET):
+    """Returns the longest prefix of text that fits in max_tokens tokens."""
+    # Every token covers at least one character, so short text always fits.
+    if len(text) <= max_tokens:
+        return text
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    # Tokens rarely exceed ~8 characters, so only the head of a long document needs encoding.
+    # Special-token strings such as "<|endoftext|>" in the notes are encoded as plain text.
+    head = text[:max_tokens * 8]
+    tokens = encoding.encode(head, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return head
+    return encoding.decode(tokens[:max_tokens])
+
+
+# Output budgets per question; thinking is disabled so the whole budget goes to the answer.
+MCQ_TOKENS_PER_QUESTION = 250
+VIVA_TOKENS_PER_QUESTION = 60
+
+MCQ_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING"},
+            "options": {"type": "ARRAY", "items": {"type": "STRING"}, "minItems": 4, "maxItems": 4},
+            "answer": {"type": "STRING"},
+        },
+        "required": ["question", "options", "answer"],
+        "propertyOrdering": ["question", "options", "answer"],
+    },
+}
+
+VIVA_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+
+QUIZ_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"mcqs": MCQ_SCHEMA, "viva": VIVA_SCHEMA},
+    "required": ["mcqs", "viva"],
+    "propertyOrdering": ["mcqs", "viva"],
+}
+
+
+def json_generation_config(schema, max_output_tokens):
+    return {
+        "responseMimeType": "application/json",
+        "responseSchema": schema,
+        "maxOutputTokens": max_output_tokens,
+        "thinkingConfig": {"thinkingBudget": 0},
+    }
 
 
+# Prompt templates are built once; request paths only fill in the placeholders.
+QUIZ_PROMPT = string.Template(STRICT_SYSTEM_INSTRUCTION + "\n\n" + """
+You are an expert exam question setter and academic examiner.
 
-def generate_mcqs(text, num_questions=10):
-    """Generates exam-based short MCQs using the Gemini API."""
-
-    prompt = STRICT_SYSTEM_INSTRUCTION + "\n\n" + f"""
-You are an expert exam question setter.
-
-Generate {num_questions} **short, exam-style multiple-choice questions (MCQs)** 
-based strictly on the following notes. 
+Based strictly on the following notes, generate:
+- $n_mcq **short, exam-style multiple-choice questions (MCQs)**.
+- Exactly $n_viva high-level viva questions (Analysis, Synthesis, or Evaluation).
 
 Each MCQ must:
 - Be concise and relevant (max 1 sentence).
@@ -157,93 +351,191 @@ Each MCQ must:
 - Have exactly **one correct answer**.
 - Be suitable for college-level objective exams.
 
-Provide output in this exact format:
-1. Question?
-A) Option 1
-B) Option 2
-C) Option 3
-D) Option 4
-Answer: C) Correct Option
+Return a JSON object with:
+- "mcqs": an array where each item has:
+  - "question": the question text, without numbering.
+  - "options": the 4 options in order A, B, C, D, without letter prefixes.
+  - "answer": the correct option with its letter, e.g. "C) Correct Option".
+- "viva": an array of viva question strings, without numbering.
 
 Notes:
-{text[:4000]}
-    """
+$text
+    """)
 
-    try:
-        raw_text = call_gemini(prompt)
-        if not raw_text:
-            return []
-
-        raw = raw_text.strip().split("\n")
-
-        questions, current_q = [], {}
-
-        for line in raw:
-            line = line.strip()
-            if line.startswith(tuple(str(i)+'.' for i in range(1, 100))):
-                if current_q:
-                    questions.append(current_q)
-                    current_q = {}
-                current_q["question"] = line
-                current_q["options"] = []
-            elif line.startswith(("A)", "B)", "C)", "D)")):
-                current_q.setdefault("options", []).append(line)
-            elif line.lower().startswith("answer:"):
-                current_q["answer"] = line.split(":", 1)[-1].strip()
-            if len(questions) >= num_questions:
-                break
-
-        if current_q:
-            questions.append(current_q)
-
-        formatted = []
-        for q in questions[:num_questions]:
-            formatted.append({
-                "question": q.get("question", ""),
-                "options": [(opt[3:].strip() if len(opt) > 2 else opt.strip()) 
-            for opt in q.get("options", [])],
-              
-                "answer": q.get("answer", ""),
-                "bloom": classify_bloom(q.get("question", "")),
-            })
-        return formatted
+CHAT_PROMPT = string.Template("""
+         You are a teaching assistant.
+         Answer the question ONLY using the following notes.
+         If the answer is not present ,say "Answer not found in the notes"
+         Notes:
+         $notes
+         Question:
+         $question   
+         """)
+
+
+def _is_text(value):
+    return isinstance(value, str) and bool(value.strip())
+
+
+def parse_quiz(raw_text, num_mcqs, num_viva):
+    """Splits a JSON quiz reply into MCQ and viva lists, skipping malformed items one by one."""
+    data = json.loads(raw_text)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object with 'mcqs' and 'viva'")
+
+    mcqs = []
+    for item in data.get("mcqs") or []:
+        if len(mcqs) >= num_mcqs:
+            break
+        if not isinstance(item, dict):
+            continue
+        question, options, answer = item.get("question"), item.get("options"), item.get("answer")
+        if not (_is_text(question) and _is_text(answer) and isinstance(options, list)
+                and len(options) == 4 and all(_is_text(opt) for opt in options)):
+            continue
+        question = question.strip()
+        mcqs.append({
+            "question": question,
+            "options": [opt.strip() for opt in options],
+            "answer": answer.strip(),
+            "bloom": classify_bloom(question),
+        })
+
+    viva = []
+    for q in data.get("viva") or []:
+        if len(viva) >= num_viva:
+            break
+        if not _is_text(q):
+            continue
+        viva.append({
+            "question": q.strip(),
+            "bloom": classify_bloom(q)
+        })
+    return mcqs, viva
+
+
+def generate_all(text, num_mcqs=10, num_viva=5, use_cache=True):
+    """Generates MCQs and viva questions with a single Gemini request and splits the JSON reply."""
+
+    prompt = QUIZ_PROMPT.substitute(n_mcq=num_mcqs, n_viva=num_viva, text=truncate_to_tokens(text))
+    config = json_generation_config(
+        QUIZ_SCHEMA,
+        MCQ_TOKENS_PER_QUESTION * num_mcqs + VIVA_TOKENS_PER_QUESTION * num_viva,
+    )
 
-    except Exception as e:
-        st.error(f"Gemini API Call Failed (MCQs): {e}")
-        return []
-    
-def generate_viva_questions(text, num_questions=5):
-
-    prompt = f"""
-    You are an academic examiner.
-    Based on the following lecture notes, generate exactly {num_questions} high-level viva questions (Analysis, Synthesis, or Evaluation).
-    Rules:
-    -Output ONLY numbered questions
-    -one question per line
-    -No explanationa or extra text
-    Notes:
-    ---
-    {text[:4000]} 
-    """
+    def usable(raw_text):
+        try:
+            return any(parse_quiz(raw_text, num_mcqs, num_viva))
+        except ValueError:
+            return False
 
     try:
-        raw_text = call_gemini(prompt)
+        raw_text = call_gemini(prompt, config, validate=usable, use_cache=use_cache)
         if not raw_text:
-            return []
-       
-        matches = re.findall(r"\d+\.\s*(.+)",raw_text)
-        
-        questions = []
-        for q  in matches[:num_questions]:
-            questions.append({
-                "question":q.strip(),
-                "bloom" :classify_bloom(q)
-            })
-        return questions
-        
-    except Exception as e:
-        st.error(f"Gemini API Call Failed (Viva Questions): {e}")
-        return []   
+            return [], []
+        mcqs, viva = parse_quiz(raw_text, num_mcqs, num_viva)
+        if not (mcqs or viva):
+            st.error("Gemini's reply did not contain any usable questions.")
+        return mcqs, viva
+
+    except ValueError as e:
+        st.error(f"Gemini returned an unreadable reply: {e}")
+        return [], []
+
+@st.cache_resource
+def load_question_encoder():
+    """Loads the small CPU sentence encoder used by the chat semantic cache (None if unavailable)."""
+    try:
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", device="cpu")
+    except Exception:
+        # Not installed, or the model could not be fetched from the Hugging Face Hub;
+        # chat then relies on the exact-prompt cache alone.
+        return None
+
+
+def find_similar_answer(notes_sha, question_vec):
+    """Returns a previous answer for a near-duplicate question asked about the same notes."""
+    cache = st.session_state.get("qa_cache")
+    if not cache or cache["notes_sha"] != notes_sha or not cache["answers"]:
+        return None
+    scores = np.dot(cache["vectors"], question_vec)
+    best = int(np.argmax(scores))
+    if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+        return cache["answers"][best]
+    return None
+
+
+def remember_answer(notes_sha, question_vec, answer):
+    cache = st.session_state.get("qa_cache")
+    if not cache or cache["notes_sha"] != notes_sha:
+        cache = {
+            "notes_sha": notes_sha,
+            "vectors": np.empty((0, question_vec.shape[0]), dtype=question_vec.dtype),
+            "answers": [],
+        }
+    cache["vectors"] = np.vstack([cache["vectors"], question_vec])
+    cache["answers"].append(answer)
+    st.session_state["qa_cache"] = cache
+
+
+def answer_from_notes(notes, question):
+    """Answers a chat question from the notes, reusing answers to near-duplicate questions."""
+    encoder = load_question_encoder()
+    notes_sha = hashlib.sha256(notes.encode()).hexdigest()
+    question_vec = None
+    if encoder is not None:
+        question_vec = encoder.encode(question, normalize_embeddings=True)
+        cached = find_similar_answer(notes_sha, question_vec)
+        if cached:
+            return cached
+
+    prompt = CHAT_PROMPT.substitute(notes=truncate_to_tokens(notes), question=question)
+    response = call_gemini(prompt)
+    if response and question_vec is not None:
+        remember_answer(notes_sha, question_vec, response)
+    return response
+
+_RUN_BREAKS = re.compile(r"([\t\n\r])")
+
+
+def _docx_paragraph(text="\n", style_id=None):
+    """Builds a <w:p> element directly; the default text gives a blank-line paragraph.
+
+    Like python-docx's run text setter, tabs become <w:tab/> and line breaks <w:br/>.
+    """
+    p = OxmlElement("w:p")
+    if style_id:
+        p_pr = OxmlElement("w:pPr")
+        p_style = OxmlElement("w:pStyle")
+        p_style.set(qn("w:val"), style_id)
+        p_pr.append(p_style)
+        p.append(p_pr)
+    r = OxmlElement("w:r")
+    for piece in _RUN_BREAKS.split(text):
+        if piece == "\t":
+            r.append(OxmlElement("w:tab"))
+        elif piece in ("\n", "\r"):
+            r.append(OxmlElement("w:br"))
+        elif piece:
+            t = OxmlElement("w:t")
+            t.text = piece
+            if piece != piece.strip():
+                t.set(qn("xml:space"), "preserve")
+            r.append(t)
+    p.append(r)
+    return p
+
+
+def _append_paragraphs(document, paragraphs):
+    """Inserts prebuilt paragraphs at the end of the body, ahead of the section properties."""
+    body = document.element.body
+    if body.sectPr is None:
+        body.extend(paragraphs)
+        return
+    for p in paragraphs:
+        body.sectPr.addprevious(p)
+
 
 def create_word_document(mcqs, viva_questions):
     """Creates a .docx file from the generated questions."""
@@ -252,19 +544,23 @@ def create_word_document(mcqs, viva_questions):
     
    
     document.add_heading('Multiple Choice Questions (MCQs)', level=1)
+    paragraphs = []
     for i, q in enumerate(mcqs, 1):
-        document.add_paragraph(f"Q{i}: {q['question']}", style='List Number')
+        paragraphs.append(_docx_paragraph(f"Q{i}: {q['question']}", "ListNumber"))
         for idx, opt in enumerate(q['options']):
-            document.add_paragraph(f"  {chr(65+idx)}. {opt}", style='List Bullet')
-        document.add_paragraph(f"✅ Answer: {q['answer']} | 🧠 Bloom Level: {q['bloom']}").bold = True
-        document.add_paragraph("\n")
+            paragraphs.append(_docx_paragraph(f"  {chr(65+idx)}. {opt}", "ListBullet"))
+        paragraphs.append(_docx_paragraph(f"✅ Answer: {q['answer']} | 🧠 Bloom Level: {q['bloom']}"))
+        paragraphs.append(_docx_paragraph())
+    _append_paragraphs(document, paragraphs)
 
     
     document.add_heading('Viva/Discussion Questions', level=1)
+    paragraphs = []
     for i, q in enumerate(viva_questions, 1):
-        document.add_paragraph(f"Q{i}: {q['question']}", style='List Number')
-        document.add_paragraph(f"🧠 Bloom Level: {q['bloom']}").bold = True
-        document.add_paragraph("\n") 
+        paragraphs.append(_docx_paragraph(f"Q{i}: {q['question']}", "ListNumber"))
+        paragraphs.append(_docx_paragraph(f"🧠 Bloom Level: {q['bloom']}"))
+        paragraphs.append(_docx_paragraph())
+    _append_paragraphs(document, paragraphs)
     
     
     doc_io = io.BytesIO()
@@ -306,14 +602,15 @@ def main():
 
         if uploaded_file:
             file_extension = uploaded_file.name.split('.')[-1].lower()
+            file_bytes = uploaded_file.getvalue()
             text = ""
 
             if file_extension == "pdf":
                 with st.spinner("Extracting text from PDF..."):
-                    text = extract_text_from_pdf(uploaded_file)
+                    text = extract_text_from_pdf(file_bytes)
             elif file_extension == "csv":
                 with st.spinner("Extracting text from CSV..."):
-                    text = extract_text_from_csv(uploaded_file)
+                    text = extract_text_from_csv(file_bytes)
             else:
                 st.error("❌ Invalid file format. Please provide a PDF or CSV file.")
                 st.stop()
@@ -324,13 +621,24 @@ def main():
             st.session_state["text"] =text
 
            
-            with st.spinner(f"Generating {num_mcqs} MCQs and {num_viva} Viva Questions..."):
-                mcqs = generate_mcqs(text, num_questions=num_mcqs)
-                viva = generate_viva_questions(text, num_questions=num_viva)
-
-           
-            st.session_state["results"] = (mcqs, viva)
-            st.success("✅ Questions generated successfully! Go to the 'Generated Questions' tab to view them.") 
+            # Only regenerate when the file or the question counts change (or on request),
+            # not on every rerun; failed attempts are retried via the button, not automatically.
+            gen_key = (hashlib.md5(file_bytes).hexdigest(), num_mcqs, num_viva, PROMPT_VERSION)
+            regenerate = st.button("🔄 Regenerate Questions")
+            if regenerate or st.session_state.get("gen_key") != gen_key:
+                with st.spinner(f"Generating {num_mcqs} MCQs and {num_viva} Viva Questions..."):
+                    # Regenerate asks Gemini again instead of replaying the cached reply.
+                    mcqs, viva = generate_all(text, num_mcqs=num_mcqs, num_viva=num_viva, use_cache=not regenerate)
+
+               
+                st.session_state["results"] = (mcqs, viva)
+                st.session_state["gen_key"] = gen_key
+
+            mcqs, viva = st.session_state["results"]
+            if mcqs or viva:
+                st.success("✅ Questions generated successfully! Go to the 'Generated Questions' tab to view them.") 
+            else:
+                st.warning("⚠️ No questions were generated. Click 'Regenerate Questions' to ask the AI again, or try fewer questions.")
 
     with tab2:
       st.header("Step 2: View Generated Questions")
@@ -393,17 +701,8 @@ def main():
         user_input = st.chat_input("Ask a question from your uploaded notes...")
         response=None
         if user_input:
-         prompt =f"""
-         You are a teaching assistant.
-         Answer the question ONLY using the following notes.
-         If the answer is not present ,say "Answer not found in the notes"
-         Notes:
-         {st.session_state["text"][:3000]}
-         Question:
-         {user_input}   
-         """
          with st.spinner("Thinking..."):
-             response = call_gemini(prompt)
+             response = answer_from_notes(st.session_state["text"], user_input)
         if response:
             st.markdown("### 🤖 Answer")
             st.write(response)